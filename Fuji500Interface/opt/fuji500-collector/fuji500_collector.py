@@ -15,6 +15,9 @@ IMPORTANTE:
   se deben **configurar de acuerdo con el equipo** (menú de servicio / documentación).
   Aquí proveemos valores por defecto que debes sobrescribir si difieren.
 - Este proceso rota el archivo cuando detecta **inactividad** o cuando aparece un **byte EOT** (opcional).
+- Cada lote se escribe de una sola vez al rotar (open O_APPEND, write, close); no se
+  llama a fsync/fdatasync: la caché de páginas agrupa las escrituras y el sistema de
+  archivos decide cuándo persistirlas.
 - Si en lugar de RS‑232 usas **LAN**, cambia la lectura serial por un socket TCP y conserva el resto.
 
 Variables de entorno (puedes declararlas en /etc/default/fuji500-collector):
@@ -29,6 +32,8 @@ Variables de entorno (puedes declararlas en /etc/default/fuji500-collector):
   FUJI500_EOT_HEX=       # ej. '04' para ASCII EOT
   FUJI500_RTSCTS=0       # 1 para habilitar control de flujo RTS/CTS si el equipo lo exige
   FUJI500_DSRDTR=0       # 1 para habilitar DSR/DTR si el equipo lo exige
+  FUJI500_RT=0           # 1 para SCHED_FIFO + mlockall (requiere CAP_SYS_NICE/CAP_IPC_LOCK
+                         # o LimitRTPRIO=/LimitMEMLOCK= en la unidad systemd)
 
 Requisitos:
   pip install pyserial
@@ -38,38 +43,57 @@ Ejecución como servicio:
 """
 import os
 import time
-import datetime
+import itertools
 import pathlib
 import binascii
 import sys
 
 
-def _get_env_int(name, default):
-    """Lee un entero de variables de entorno, con valor por defecto si falta/está mal."""
-    try:
-        return int(os.environ.get(name, str(default)))
-    except Exception:
+def _env(name, default, cast=str):
+    """Lee una variable de entorno convertida con `cast`; usa `default` si falta/está mal."""
+    value = os.environ.get(name)
+    if value is None:
         return default
-
-def _get_env_float(name, default):
-    """Lee un float de variables de entorno, con valor por defecto si falta/está mal."""
     try:
-        return float(os.environ.get(name, str(default)))
-    except Exception:
+        return cast(value)
+    except ValueError:
         return default
 
+def _flag(value):
+    """Interpreta un interruptor de entorno: '', '0', 'false', 'no', 'off' -> False."""
+    return value.strip().lower() not in ("", "0", "false", "no", "off")
+
 # --- Configuración por entorno (ajusta con los parámetros reales del equipo) ---
-INBOX = os.environ.get("FUJI500_INBOX", "/var/senaite/inbox/fuji500")
-PORT  = os.environ.get("FUJI500_PORT",  "/dev/ttyUSB0")
-BAUD  = _get_env_int("FUJI500_BAUD", 9600)
-BYTESIZE = _get_env_int("FUJI500_BYTESIZE", 8)  # 5,6,7,8
-PARITY   = os.environ.get("FUJI500_PARITY", "N").upper()  # N,E,O,M,S
-STOPBITS = float(os.environ.get("FUJI500_STOPBITS", "1"))  # 1, 1.5, 2
-TIMEOUT  = _get_env_float("FUJI500_TIMEOUT", 2.0)  # seg para .read()
-IDLE_SECONDS = _get_env_float("FUJI500_IDLE_SECONDS", 1.5)  # rota por inactividad
-EOT_HEX = os.environ.get("FUJI500_EOT_HEX", "").strip()    # separador de fin de transmisión
-RTSCTS  = bool(_get_env_int("FUJI500_RTSCTS", 0))  # Control de flujo por hardware RTS/CTS
-DSRDTR  = bool(_get_env_int("FUJI500_DSRDTR", 0))  # Control de flujo por hardware DSR/DTR
+INBOX = _env("FUJI500_INBOX", "/var/senaite/inbox/fuji500")
+PORT  = _env("FUJI500_PORT",  "/dev/ttyUSB0")
+BAUD  = _env("FUJI500_BAUD", 9600, int)
+BYTESIZE = _env("FUJI500_BYTESIZE", 8, int)  # 5,6,7,8
+PARITY   = _env("FUJI500_PARITY", "N").upper()  # N,E,O,M,S
+STOPBITS = _env("FUJI500_STOPBITS", 1.0, float)  # 1, 1.5, 2
+TIMEOUT  = _env("FUJI500_TIMEOUT", 2.0, float)  # seg para .read()
+IDLE_SECONDS = _env("FUJI500_IDLE_SECONDS", 1.5, float)  # rota por inactividad
+EOT_HEX = _env("FUJI500_EOT_HEX", "").strip()    # separador de fin de transmisión
+RTSCTS  = _env("FUJI500_RTSCTS", False, _flag)  # Control de flujo por hardware RTS/CTS
+DSRDTR  = _env("FUJI500_DSRDTR", False, _flag)  # Control de flujo por hardware DSR/DTR
+RT      = _env("FUJI500_RT", False, _flag)  # Planificación en tiempo real (SCHED_FIFO + mlockall)
+
+# Marcador EOT ya decodificado (p. ej., '04' -> ASCII EOT); None si está deshabilitado
+EOT = None
+if EOT_HEX:
+    try:
+        EOT = binascii.unhexlify(EOT_HEX)
+    except ValueError:
+        print(f"[FUJI500] AVISO: EOT_HEX '{EOT_HEX}' no es válido; se ignora.", file=sys.stderr)
+
+# Banderas de mlockall(2) en Linux
+_MCL_CURRENT = 1
+_MCL_FUTURE = 2
+
+# Espera entre sondeos cuando FUJI500_TIMEOUT=0 (lectura no bloqueante)
+POLL_SECONDS = 0.05
+
+# Umbral para compactar el buffer de recepción (bytes ya volcados al inicio)
+COMPACT_BYTES = 64 * 1024
 
 # Carga perezosa de pyserial para evitar fallo si aún no está instalado
 try:
@@ -78,7 +102,17 @@ except Exception as e:
     print("[FUJI500] ERROR: pyserial no está instalado. Instala con: pip install pyserial", file=sys.stderr)
     raise
 
-def _serial_params():
+# Paridad: letra de FUJI500_PARITY -> índice en la tupla de constantes de pyserial
+_PARITY_IDX = {"N": 0, "E": 1, "O": 2, "M": 3, "S": 4}
+_PARITY_TUP = (
+    serial.PARITY_NONE,
+    serial.PARITY_EVEN,
+    serial.PARITY_ODD,
+    serial.PARITY_MARK,
+    serial.PARITY_SPACE,
+)
+
+def _compute_serial_params():
     """Mapea los parámetros lógicos a constantes de pyserial."""
     # Bits de datos
     if BYTESIZE == 5: bytesize = serial.FIVEBITS
@@ -86,15 +120,8 @@ def _serial_params():
     elif BYTESIZE == 7: bytesize = serial.SEVENBITS
     else: bytesize = serial.EIGHTBITS
 
-    # Paridad
-    parity_map = {
-        "N": serial.PARITY_NONE,
-        "E": serial.PARITY_EVEN,
-        "O": serial.PARITY_ODD,
-        "M": serial.PARITY_MARK,
-        "S": serial.PARITY_SPACE,
-    }
-    parity = parity_map.get(PARITY, serial.PARITY_NONE)
+    # Paridad (valor desconocido -> sin paridad)
+    parity = _PARITY_TUP[_PARITY_IDX.get(PARITY, 0)]
 
     # Bits de parada
     if STOPBITS == 1: stopbits = serial.STOPBITS_ONE
@@ -103,10 +130,64 @@ def _serial_params():
 
     return bytesize, parity, stopbits
 
+# Constantes de pyserial resueltas una sola vez al importar
+BYTESIZE_CONST, PARITY_CONST, STOPBITS_CONST = _compute_serial_params()
+
+# Secuencia de lotes dentro de este proceso y prefijo fijo de sus rutas
+_BATCH_SEQ = itertools.count()
+_BATCH_PREFIX = os.path.join(INBOX, "fuji500_")
+
 def _new_batch_path():
     """Genera un nombre de archivo único para cada “lote” recibido del analizador."""
-    ts = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-    return os.path.join(INBOX, f"fuji500_{ts}.raw")
+    sec, usec = divmod(time.time_ns() // 1000, 1_000_000)
+    ts = time.strftime("%Y%m%d_%H%M%S", time.localtime(sec))
+    # El contador evita colisiones si dos lotes rotan en el mismo microsegundo
+    return f"{_BATCH_PREFIX}{ts}_{usec:06d}_{next(_BATCH_SEQ)}.raw"
+
+def _enable_realtime():
+    """
+    Pasa el proceso a SCHED_FIFO y bloquea su memoria en RAM, para que ni la
+    carga ajena ni los fallos de página retrasen el temporizador de inactividad.
+    Si el sistema no lo permite, avisa y sigue con la planificación normal.
+    """
+    # ctypes sólo se carga si se pidió tiempo real (FUJI500_RT=1)
+    import ctypes
+    import ctypes.util
+
+    try:
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(20))
+    except (AttributeError, OSError) as e:
+        print(f"[FUJI500] AVISO: no se pudo activar SCHED_FIFO ({e}); se continúa sin tiempo real.", file=sys.stderr)
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        mlockall = libc.mlockall
+    except (AttributeError, OSError) as e:
+        print(f"[FUJI500] AVISO: mlockall no disponible ({e}); la memoria puede paginarse.", file=sys.stderr)
+        return
+    if mlockall(_MCL_CURRENT | _MCL_FUTURE) != 0:
+        err = ctypes.get_errno()
+        print(f"[FUJI500] AVISO: mlockall falló ({os.strerror(err)}); la memoria puede paginarse.", file=sys.stderr)
+
+def _open_batch(path):
+    """Abre (o crea) el archivo del lote en modo append y devuelve su descriptor."""
+    # Sin O_SYNC/O_DSYNC ni fsync al cerrar: el kernel decide cuándo volcar a disco.
+    return os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+def _write_all(fd, data):
+    """Escribe `data` completo en `fd` (os.write puede escribir parcialmente)."""
+    view = memoryview(data)
+    while view:
+        n = os.write(fd, view)
+        view = view[n:]
+
+def _write_batch(path, data):
+    """Vuelca un lote completo a `path`: abre, escribe todo y cierra."""
+    fd = _open_batch(path)
+    try:
+        _write_all(fd, data)
+    finally:
+        os.close(fd)
 
 def main():
     """
@@ -120,7 +201,8 @@ def main():
     # Asegura que la carpeta de entrada exista
     pathlib.Path(INBOX).mkdir(parents=True, exist_ok=True)
 
-    bytesize, parity, stopbits = _serial_params()
+    if RT:
+        _enable_realtime()
 
     # Nota: En RS‑232, según el manual, existen líneas RTS/CTS y DTR/DSR (D‑SUB 9).
     # Si tu configuración de LIS exige control de flujo por hardware, habilítalo abajo
@@ -130,22 +212,13 @@ def main():
     print(f"[FUJI500] Inbox: {INBOX}")
     print(f"[FUJI500] Rotación por inactividad: {IDLE_SECONDS}s  EOT_HEX: {EOT_HEX or '(deshabilitado)'}")
 
-    # Prepara EOT si está configurado (p. ej., '04' -> ASCII EOT)
-    eot = None
-    if EOT_HEX:
-        try:
-            eot = binascii.unhexlify(EOT_HEX)
-        except Exception as e:
-            print(f"[FUJI500] AVISO: EOT_HEX '{EOT_HEX}' no es válido; se ignora.", file=sys.stderr)
-            eot = None
-
     # Abre el puerto serie
     with serial.Serial(
         PORT,
         BAUD,
-        bytesize=bytesize,
-        parity=parity,
-        stopbits=stopbits,
+        bytesize=BYTESIZE_CONST,
+        parity=PARITY_CONST,
+        stopbits=STOPBITS_CONST,
         timeout=TIMEOUT,
         rtscts=RTSCTS,
         dsrdtr=DSRDTR,
@@ -153,41 +226,63 @@ def main():
         buf = bytearray()
         last_data = time.time()
         current_path = _new_batch_path()
+        head = 0       # inicio lógico del contenido pendiente: buf[head:]
+        scan_from = 0  # hasta dónde ya se buscó EOT dentro de `buf`
 
         while True:
-            # Lee hasta 1024 bytes o hasta agotar TIMEOUT
-            chunk = ser.read(1024)
+            # Lee lo que ya esté en el buffer del driver; si no hay nada,
+            # bloquea hasta que llegue al menos 1 byte o se agote TIMEOUT
+            # (con TIMEOUT=0 la lectura no bloquea; ver la espera más abajo).
+            chunk = ser.read(ser.in_waiting or 1)
             now = time.time()
 
             if chunk:
                 # Llegaron bytes: acumula en buffer y registra “último dato”
                 buf.extend(chunk)
                 last_data = now
+                # Si despertamos por el primer byte de una ráfaga, drena en la
+                # misma vuelta lo que haya llegado detrás (directo al buffer,
+                # sin concatenar `bytes` intermedios).
+                pending = ser.in_waiting
+                if pending:
+                    buf.extend(ser.read(pending))
 
-                # Si hay un byte/paquete EOT configurado, dividimos allí
-                if eot and eot in buf:
-                    parts = buf.split(eot)
+                # Si hay un byte/paquete EOT configurado, dividimos allí.
+                # Sólo se busca en los bytes recién llegados (más el solape
+                # de len(EOT)-1 por si el marcador quedó partido entre lecturas).
+                if EOT:
+                    prev = head
+                    idx = buf.find(EOT, max(head, scan_from - len(EOT) + 1))
                     # Para cada bloque completo antes del EOT:
-                    for part in parts[:-1]:
-                        if part:
-                            with open(current_path, "ab") as f:
-                                f.write(part)
-                            print(f"[FUJI500] Archivo (por EOT): {current_path} ({len(part)} bytes)")
+                    while idx != -1:
+                        if idx > prev:
+                            _write_batch(current_path, memoryview(buf)[prev:idx])
+                            print(f"[FUJI500] Archivo (por EOT): {current_path} ({idx - prev} bytes)")
                             current_path = _new_batch_path()
-                    # Deja el remanente en el buffer
-                    buf = bytearray(parts[-1])
+                        prev = idx + len(EOT)
+                        idx = buf.find(EOT, prev)
+                    # Deja el remanente en el buffer; sólo se compacta cuando
+                    # el prefijo ya consumido es grande, no en cada mensaje.
+                    head = prev
+                    if head >= COMPACT_BYTES or head > len(buf) // 2:
+                        del buf[:head]
+                        head = 0
+                    scan_from = len(buf)
 
             else:
                 # No llegaron bytes en este ciclo; si hay inactividad suficiente,
                 # persistimos lo que haya y comenzamos un nuevo archivo.
-                if buf and (now - last_data) >= IDLE_SECONDS:
-                    with open(current_path, "ab") as f:
-                        f.write(buf)
-                    print(f"[FUJI500] Archivo (por inactividad): {current_path} ({len(buf)} bytes)")
+                if len(buf) > head and (now - last_data) >= IDLE_SECONDS:
+                    _write_batch(current_path, memoryview(buf)[head:])
+                    print(f"[FUJI500] Archivo (por inactividad): {current_path} ({len(buf) - head} bytes)")
                     buf.clear()
+                    head = 0
+                    scan_from = 0
                     current_path = _new_batch_path()
-                # Pequeña espera para no atar el CPU
-                time.sleep(0.05)
+                # Con TIMEOUT=0 el read no bloquea: sondeo con una pequeña espera
+                # para no atar el CPU (sobre todo bajo SCHED_FIFO).
+                if not TIMEOUT:
+                    time.sleep(POLL_SECONDS)
 
 if __name__ == "__main__":
     try:
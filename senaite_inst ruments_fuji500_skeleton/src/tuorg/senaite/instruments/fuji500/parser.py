@@ -31,6 +31,7 @@ El resultado del parser es una lista de diccionarios, uno por determinación, p.
   }
 ]
 """
+import re
 from typing import List, Dict
 
 # Mapa provisional: código del equipo -> keyword del Analysis Service
@@ -41,16 +42,20 @@ TEST_MAP = {
     # "CREA": "creatinine",
 }
 
+# Separador de líneas: cualquier racha de CR/LF (descarta de paso las líneas vacías)
+_EOL_RE = re.compile(rb"[\r\n]+")
+
+# RES,<codigo>,<valor>,<unidad>[,<flags>[,...]] — los campos extra se ignoran
+_RES_RE = re.compile(r"RES,([^,]*),([^,]*),([^,]*)(?:,([^,]*))?")
+
 def decode_lines(raw: bytes) -> List[str]:
     """
     Devuelve una lista de líneas textual a partir de bytes.
     Ajusta `encoding`/normalización según el manual del equipo.
     """
-    text = raw.decode("latin-1", errors="ignore")
-    # Normalización básica CR/LF
-    text = text.replace("\r\n", "\n").replace("\r", "\n")
-    lines = [ln.strip() for ln in text.split("\n") if ln.strip()]
-    return lines
+    # Un único split en bytes; se decodifica y recorta cada línea una sola vez
+    stripped = (ln.decode("latin-1").strip() for ln in _EOL_RE.split(raw) if ln)
+    return [ln for ln in stripped if ln]
 
 def parse_results(lines: List[str]) -> List[Dict]:
     """
@@ -68,20 +73,24 @@ def parse_results(lines: List[str]) -> List[Dict]:
         if ln.startswith("SID,"):
             current_sid = ln.split(",", 1)[1].strip()
             continue
-        if ln.startswith("RES,") and current_sid:
-            parts = [p.strip() for p in ln.split(",")]
-            if len(parts) >= 4:
-                code, value, unit = parts[1], parts[2], parts[3]
-                keyword = TEST_MAP.get(code)
-                if keyword:
-                    out.append({
-                        "SampleID": current_sid,
-                        "keyword": keyword,
-                        "result": value,
-                        "unit": unit,
-                        "flags": parts[4] if len(parts) > 4 else None,
-                        "meta": {"raw": ln},
-                    })
+        if not current_sid:
+            continue
+        m = _RES_RE.match(ln)
+        if not m:
+            continue
+        # Descarta códigos sin mapear antes de tocar el resto de campos
+        keyword = TEST_MAP.get(m.group(1).strip())
+        if not keyword:
+            continue
+        _, value, unit, flags = m.groups()
+        out.append({
+            "SampleID": current_sid,
+            "keyword": keyword,
+            "result": value.strip(),
+            "unit": unit.strip(),
+            "flags": flags.strip() if flags is not None else None,
+            "meta": {"raw": ln},
+        })
     return out
 
 def parse_file(raw: bytes) -> List[Dict]: